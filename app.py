@@ -1,10 +1,18 @@
-from flask import Flask, render_template, redirect, url_for, flash, request, jsonify
+from flask import Flask, render_template, redirect, url_for, flash, request, jsonify, abort
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
+from werkzeug.exceptions import HTTPException
 from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy import event, func, insert, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+import orjson
+import logging
 import os
 from datetime import datetime
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
 import re
+import sqlite3
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.urandom(24)
@@ -12,58 +20,126 @@ app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///financial_dashboard.db'
 db = SQLAlchemy(app)
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
+# INFO em produção; DEBUG quando FLASK_DEBUG está ativo (o __main__ ajusta o nível para o app.run(debug=True))
+app.logger.setLevel(logging.DEBUG if app.debug else logging.INFO)
+
+@event.listens_for(Engine, 'connect')
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Ativa WAL e fsync reduzido em cada conexão SQLite para baratear os commits"""
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.close()
+
+# Formato aceito para a data de referência (MM/YYYY)
+_DATE_RE = re.compile(r'^(0[1-9]|1[0-2])/20[0-9]{2}$')
+
+# Campos monetários de FinancialData, na ordem em que são expostos pela API
+_MONEY_FIELDS = (
+    'cash_balance', 'bank_balance', 'accounts_receivable', 'inventory_balance',
+    'other_credits', 'fixed_assets', 'investments', 'accounts_payable',
+    'loans_financing', 'installments_payable', 'total_sales'
+)
+_LIST_KEYS = ('id', 'user_id', 'reference_date') + _MONEY_FIELDS
+_DETAIL_KEYS = ('id', 'reference_date') + _MONEY_FIELDS
+
+# Troca separadores do formato en-US (1,234.56) para o brasileiro (1.234,56)
+_BRL_SWAP = str.maketrans({',': '.', '.': ','})
+
+def format_currency(cents):
+    """Formata um valor em centavos como moeda brasileira (R$ 1.234,56)"""
+    try:
+        return f'R$ {Decimal(cents).scaleb(-2):,.2f}'.translate(_BRL_SWAP)
+    except (ValueError, TypeError):
+        return 'R$ 0,00'
+
+# Remove símbolo da moeda, separador de milhar e espaços em uma única passada
+_MONEY_STRIP = str.maketrans('', '', 'R$. \t\n\xa0')
+
+def to_cents(amount):
+    """Converte um Decimal em reais para centavos inteiros, arredondando meio centavo para cima"""
+    return int((amount * 100).to_integral_value(rounding=ROUND_HALF_UP))
+
+def process_currency(value):
+    """Converte um valor em moeda brasileira (R$ 1.234,56) para centavos inteiros"""
+    try:
+        amount = Decimal(value.translate(_MONEY_STRIP).replace(',', '.'))
+        # NaN/Infinity não são valores monetários e não podem chegar ao banco
+        if not amount.is_finite():
+            raise InvalidOperation(f'Valor não finito: {value}')
+        return to_cents(amount)
+    except (InvalidOperation, AttributeError) as e:
+        app.logger.debug("Erro ao processar valor monetário: %s", e)
+        return 0
+
+# Custo fixo do hash de senha (scrypt N=32768, r=8, p=1), independente do padrão do Werkzeug
+_PASSWORD_HASH_METHOD = 'scrypt:32768:8:1'
+
+# Hash verificado quando o e-mail não existe, para que o login leve o mesmo tempo nos dois casos
+_DUMMY_HASH = generate_password_hash('x', method=_PASSWORD_HASH_METHOD)
 
 # Modelo do usuário
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(120), unique=True, nullable=False)
-    password_hash = db.Column(db.String(128))
+    password_hash = db.Column(db.String(256))
     name = db.Column(db.String(100))
     
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = generate_password_hash(password, method=_PASSWORD_HASH_METHOD)
         
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
 
 # Modelo para dados financeiros
 class FinancialData(db.Model):
+    # Índice composto usado por todas as consultas por usuário/mês; também garante um registro por mês
+    __table_args__ = (db.Index('ix_fd_user_date', 'user_id', 'reference_date', unique=True),)
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    reference_date = db.Column(db.String(7), nullable=False)  # Format: MM/YYYY
-    cash_balance = db.Column(db.Float, nullable=False)  # Saldo em Caixa
-    bank_balance = db.Column(db.Float, nullable=False)  # Saldo em Banco
-    accounts_receivable = db.Column(db.Float, nullable=False)  # Total de Contas a Receber
-    inventory_balance = db.Column(db.Float, nullable=False)  # Saldo em estoque
-    other_credits = db.Column(db.Float, nullable=False)  # Total de Outros Créditos
-    fixed_assets = db.Column(db.Float, nullable=False)  # Total de Bens Imobilizados
-    investments = db.Column(db.Float, nullable=False)  # Total de Investimentos
-    accounts_payable = db.Column(db.Float, nullable=False)  # Total de Contas a Pagar
-    loans_financing = db.Column(db.Float, nullable=False)  # Total de Empréstimos e Financiamentos
-    installments_payable = db.Column(db.Float, nullable=False)  # Saldo devedor de parcelamentos
-    total_sales = db.Column(db.Float, nullable=False)  # Total de vendas
+    reference_date = db.Column(db.Integer, nullable=False)  # Format: YYYYMM (ordena cronologicamente)
+    # Valores monetários em centavos inteiros: somas e subtrações no banco são exatas
+    cash_balance = db.Column(db.BigInteger, nullable=False)  # Saldo em Caixa
+    bank_balance = db.Column(db.BigInteger, nullable=False)  # Saldo em Banco
+    accounts_receivable = db.Column(db.BigInteger, nullable=False)  # Total de Contas a Receber
+    inventory_balance = db.Column(db.BigInteger, nullable=False)  # Saldo em estoque
+    other_credits = db.Column(db.BigInteger, nullable=False)  # Total de Outros Créditos
+    fixed_assets = db.Column(db.BigInteger, nullable=False)  # Total de Bens Imobilizados
+    investments = db.Column(db.BigInteger, nullable=False)  # Total de Investimentos
+    accounts_payable = db.Column(db.BigInteger, nullable=False)  # Total de Contas a Pagar
+    loans_financing = db.Column(db.BigInteger, nullable=False)  # Total de Empréstimos e Financiamentos
+    installments_payable = db.Column(db.BigInteger, nullable=False)  # Saldo devedor de parcelamentos
+    total_sales = db.Column(db.BigInteger, nullable=False)  # Total de vendas
+    equity = db.Column(db.BigInteger, db.Computed(
+        'cash_balance + bank_balance + accounts_receivable + inventory_balance + other_credits'
+        ' + fixed_assets + investments - accounts_payable - loans_financing - installments_payable'
+    ))  # Patrimônio líquido (coluna gerada pelo banco)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     @staticmethod
-    def normalize_date(date_str):
-        """Normaliza a data para o formato MM/YYYY"""
-        try:
-            month, year = date_str.strip().split('/')
-            month = month.zfill(2)  # Garante que o mês tenha dois dígitos
-            return f"{month}/{year}"
-        except:
-            return date_str
-            
-    def __init__(self, **kwargs):
-        # Normalizar a data antes de salvar
-        if 'reference_date' in kwargs:
-            kwargs['reference_date'] = self.normalize_date(kwargs['reference_date'])
-        super(FinancialData, self).__init__(**kwargs)
+    def parse_mm_yyyy(date_str):
+        """Converte uma data MM/YYYY para o inteiro YYYYMM; levanta ValueError se a data for inválida"""
+        month, year = date_str.strip().split('/')
+        if not _DATE_RE.match(f"{month.zfill(2)}/{year}"):
+            raise ValueError(f'Data de referência inválida: {date_str}')
+        return int(year) * 100 + int(month)
+
+    @staticmethod
+    def format_mm_yyyy(value):
+        """Converte o inteiro YYYYMM de volta para o formato MM/YYYY"""
+        return f"{value % 100:02d}/{value // 100:04d}"
+
+def _is_duplicate_month(error):
+    """Indica se o IntegrityError veio do índice único ix_fd_user_date"""
+    message = str(error.orig)
+    return 'UNIQUE' in message and 'reference_date' in message
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return db.session.get(User, int(user_id))
 
 @app.route('/')
 def index():
@@ -76,7 +152,13 @@ def login():
         password = request.form.get('password')
         user = User.query.filter_by(email=email).first()
         
-        if user and user.check_password(password):
+        if user:
+            ok = user.check_password(password)
+        else:
+            check_password_hash(_DUMMY_HASH, password or '')
+            ok = False
+        
+        if ok:
             login_user(user)
             return redirect(url_for('dashboard'))
         flash('Invalid email or password')
@@ -110,495 +192,308 @@ def dashboard():
 @app.route('/api/financial-data', methods=['POST'])
 @login_required
 def add_financial_data():
+    data = request.json
+    
+    # Converter e validar a data de referência (MM/YYYY -> YYYYMM)
+    try:
+        reference_date = FinancialData.parse_mm_yyyy(data['reference_date'])
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        app.logger.debug("Data de referência inválida: %s", e)
+        return jsonify({
+            'status': 'error',
+            'message': 'Formato de data inválido. Use MM/YYYY'
+        }), 400
+    
     try:
-        data = request.json
-        print("\n=== ADICIONANDO DADOS FINANCEIROS ===")
-        print(f"Dados recebidos no POST: {data}")
-        
-        # Normalizar formato da data
-        try:
-            month, year = data['reference_date'].strip().split('/')
-            month = month.zfill(2)  # Garante que o mês tenha dois dígitos
-            data['reference_date'] = f"{month}/{year}"
-            print(f"Data normalizada: {data['reference_date']}")
-            
-            # Validar se é uma data válida
-            if not re.match(r'^(0[1-9]|1[0-2])/20[0-9]{2}$', data['reference_date']):
-                raise ValueError('Formato inválido')
-                
-            datetime.strptime(data['reference_date'], '%m/%Y')
-        except (ValueError, IndexError) as e:
-            print(f"Erro na validação da data: {str(e)}")
-            return jsonify({
-                'status': 'error',
-                'message': 'Formato de data inválido. Use MM/YYYY'
-            }), 400
-        
-        # Verificar se já existe um registro para o mês
-        existing_data = FinancialData.query.filter_by(
-            user_id=current_user.id,
-            reference_date=data['reference_date']
-        ).first()
-        
-        if existing_data:
-            print(f"Já existe registro para {data['reference_date']}")
-            return jsonify({
-                'status': 'error',
-                'message': 'Já existem dados cadastrados para este mês'
-            }), 400
-        
         # Processar valores monetários
-        def process_currency(value):
-            try:
-                # Remover R$, pontos e trocar vírgula por ponto
-                processed = float(value.replace('R$', '').replace('.', '').replace(',', '.').strip())
-                print(f"Valor processado: {value} -> {processed}")
-                return processed
-            except (ValueError, AttributeError) as e:
-                print(f"Erro ao processar valor monetário: {value} - {str(e)}")
-                return 0.0
+        money_vals = {key: process_currency(data[key]) for key in _MONEY_FIELDS}
         
+        # Criar novo registro financeiro com um único INSERT, sem passar pelo unit of work do ORM
         try:
-            # Criar novo registro financeiro
-            financial_data = FinancialData(
-                user_id=current_user.id,
-                reference_date=data['reference_date'],
-                cash_balance=process_currency(data['cash_balance']),
-                bank_balance=process_currency(data['bank_balance']),
-                accounts_receivable=process_currency(data['accounts_receivable']),
-                inventory_balance=process_currency(data['inventory_balance']),
-                other_credits=process_currency(data['other_credits']),
-                fixed_assets=process_currency(data['fixed_assets']),
-                investments=process_currency(data['investments']),
-                accounts_payable=process_currency(data['accounts_payable']),
-                loans_financing=process_currency(data['loans_financing']),
-                installments_payable=process_currency(data['installments_payable']),
-                total_sales=process_currency(data['total_sales'])
+            db.session.execute(
+                insert(FinancialData).values(
+                    user_id=current_user.id,
+                    reference_date=reference_date,
+                    **money_vals
+                )
             )
-            
-            print(f"Novo registro criado: {financial_data.__dict__}")
-            
-            db.session.add(financial_data)
             db.session.commit()
-            
-            print("Dados salvos com sucesso!")
-            
-            return jsonify({
-                'status': 'success',
-                'message': 'Dados financeiros adicionados com sucesso!'
-            })
-            
-        except KeyError as e:
-            print(f"Campo obrigatório faltando: {str(e)}")
+        except IntegrityError as e:
+            # Só a violação do índice único (user_id, reference_date) indica mês duplicado;
+            # outras falhas (ex.: NOT NULL) seguem para o manipulador de erros do banco
+            if not _is_duplicate_month(e):
+                raise
+            db.session.rollback()
             return jsonify({
                 'status': 'error',
-                'message': f'Campo obrigatório faltando: {str(e)}'
+                'message': 'Já existem dados cadastrados para este mês'
             }), 400
-            
-    except Exception as e:
-        print(f"Erro ao adicionar dados: {str(e)}")
-        db.session.rollback()
+        
+        return jsonify({
+            'status': 'success',
+            'message': 'Dados financeiros adicionados com sucesso!'
+        })
+        
+    except KeyError as e:
         return jsonify({
             'status': 'error',
-            'message': str(e)
+            'message': f'Campo obrigatório faltando: {str(e)}'
         }), 400
 
 @app.route('/api/financial-data', methods=['GET'])
 @login_required
 def list_financial_data():
     """Lista todos os dados financeiros do usuário atual"""
-    try:
-        print("\n=== LISTANDO TODOS OS DADOS ===")
-        print(f"Usuário atual: {current_user.id}")
-        
-        # Buscar dados no banco
-        data = FinancialData.query.filter_by(user_id=current_user.id).all()
-        print(f"Total de registros encontrados: {len(data)}")
-        
-        result = []
-        for item in data:
-            print(f"\nRegistro encontrado:")
-            print(f"ID: {item.id}")
-            print(f"Data: {item.reference_date}")
-            print(f"Usuário: {item.user_id}")
-            
-            # Formatar valores monetários
-            def format_currency(value):
-                try:
-                    return f'R$ {float(value):,.2f}'.replace(',', '_').replace('.', ',').replace('_', '.')
-                except (ValueError, TypeError):
-                    return 'R$ 0,00'
-            
-            formatted_data = {
-                'id': item.id,
-                'user_id': item.user_id,
-                'reference_date': item.reference_date,
-                'cash_balance': format_currency(item.cash_balance),
-                'bank_balance': format_currency(item.bank_balance),
-                'accounts_receivable': format_currency(item.accounts_receivable),
-                'inventory_balance': format_currency(item.inventory_balance),
-                'other_credits': format_currency(item.other_credits),
-                'fixed_assets': format_currency(item.fixed_assets),
-                'investments': format_currency(item.investments),
-                'accounts_payable': format_currency(item.accounts_payable),
-                'loans_financing': format_currency(item.loans_financing),
-                'installments_payable': format_currency(item.installments_payable),
-                'total_sales': format_currency(item.total_sales)
-            }
-            result.append(formatted_data)
-            
-        return jsonify(result)
-        
-    except Exception as e:
-        print(f"Erro ao listar dados: {str(e)}")
-        return jsonify({
-            'status': 'error',
-            'message': str(e)
-        }), 500
+    # Buscar apenas as colunas expostas, sem instanciar objetos do ORM
+    rows = db.session.query(
+        *(getattr(FinancialData, key) for key in _LIST_KEYS)
+    ).filter_by(user_id=current_user.id).all()
+    
+    result = [
+        dict(zip(_LIST_KEYS, (
+            row.id,
+            row.user_id,
+            FinancialData.format_mm_yyyy(row.reference_date),
+            *map(format_currency, row[3:])
+        )))
+        for row in rows
+    ]
+    
+    # orjson serializa a lista inteira em código nativo, bem mais rápido que o json da stdlib
+    return app.response_class(orjson.dumps(result), mimetype='application/json')
 
 @app.route('/api/financial-data/<reference_date>', methods=['GET'])
 @login_required
 def get_financial_data(reference_date):
     """Retorna os dados financeiros de um mês específico"""
+    # Decodificar a data da URL
+    from urllib.parse import unquote
+    reference_date = unquote(reference_date)
+    
     try:
-        # Log para debug
-        print(f"\n=== BUSCANDO DADOS FINANCEIROS ===")
-        print(f"Usuário: {current_user.id}")
-        print(f"Data solicitada: {reference_date}")
-        
-        # Decodificar a data da URL
-        from urllib.parse import unquote
-        reference_date = unquote(reference_date)
-        print(f"Data decodificada: {reference_date}")
-        
-        # Buscar dados no banco
-        data = FinancialData.query.filter_by(
-            user_id=current_user.id,
-            reference_date=reference_date
-        ).first()
-        
-        print(f"Dados encontrados: {data}")
-        
-        if not data:
-            print("Nenhum dado encontrado")
-            return jsonify({
-                'status': 'error',
-                'message': 'Recurso não encontrado'
-            }), 404
-            
-        # Montar resposta
-        response_data = {
-            'id': data.id,
-            'reference_date': data.reference_date,
-            'cash_balance': f"R$ {data.cash_balance:,.2f}".replace(',', '_').replace('.', ',').replace('_', '.'),
-            'bank_balance': f"R$ {data.bank_balance:,.2f}".replace(',', '_').replace('.', ',').replace('_', '.'),
-            'accounts_receivable': f"R$ {data.accounts_receivable:,.2f}".replace(',', '_').replace('.', ',').replace('_', '.'),
-            'inventory_balance': f"R$ {data.inventory_balance:,.2f}".replace(',', '_').replace('.', ',').replace('_', '.'),
-            'other_credits': f"R$ {data.other_credits:,.2f}".replace(',', '_').replace('.', ',').replace('_', '.'),
-            'fixed_assets': f"R$ {data.fixed_assets:,.2f}".replace(',', '_').replace('.', ',').replace('_', '.'),
-            'investments': f"R$ {data.investments:,.2f}".replace(',', '_').replace('.', ',').replace('_', '.'),
-            'accounts_payable': f"R$ {data.accounts_payable:,.2f}".replace(',', '_').replace('.', ',').replace('_', '.'),
-            'loans_financing': f"R$ {data.loans_financing:,.2f}".replace(',', '_').replace('.', ',').replace('_', '.'),
-            'installments_payable': f"R$ {data.installments_payable:,.2f}".replace(',', '_').replace('.', ',').replace('_', '.'),
-            'total_sales': f"R$ {data.total_sales:,.2f}".replace(',', '_').replace('.', ',').replace('_', '.')
-        }
-        
-        print(f"Resposta formatada: {response_data}")
-        return jsonify(response_data)
-        
-    except Exception as e:
-        print(f"Erro ao buscar dados: {str(e)}")
+        reference_date = FinancialData.parse_mm_yyyy(reference_date)
+    except ValueError:
         return jsonify({
             'status': 'error',
-            'message': str(e)
-        }), 500
+            'message': 'Formato de data inválido. Use MM/YYYY'
+        }), 400
+    
+    # Buscar apenas as colunas expostas, sem instanciar objetos do ORM
+    data = db.session.query(
+        *(getattr(FinancialData, key) for key in _DETAIL_KEYS)
+    ).filter_by(
+        user_id=current_user.id,
+        reference_date=reference_date
+    ).first()
+    
+    if not data:
+        return jsonify({
+            'status': 'error',
+            'message': 'Recurso não encontrado'
+        }), 404
+        
+    # Montar resposta
+    response_data = dict(zip(_DETAIL_KEYS, (
+        data.id,
+        FinancialData.format_mm_yyyy(data.reference_date),
+        *map(format_currency, data[2:])
+    )))
+    
+    return jsonify(response_data)
 
 @app.route('/api/financial-data/months', methods=['GET'])
 @login_required
 def get_available_months():
     """Retorna lista de meses que possuem dados cadastrados"""
-    try:
-        # Buscar todos os meses do usuário atual
-        data = FinancialData.query.filter_by(user_id=current_user.id).order_by(FinancialData.reference_date.desc()).all()
-        
-        # Extrair e normalizar as datas
-        months = [item.reference_date for item in data]
-        print(f"Meses encontrados: {months}")
-        
-        return jsonify(months)
-        
-    except Exception as e:
-        print(f"Erro ao listar meses: {str(e)}")
-        return jsonify({
-            'status': 'error',
-            'message': str(e)
-        }), 500
+    # Buscar todos os meses do usuário atual
+    data = db.session.query(FinancialData.reference_date).filter_by(user_id=current_user.id).order_by(FinancialData.reference_date.desc()).all()
+    
+    # Extrair e formatar as datas
+    months = [FinancialData.format_mm_yyyy(row[0]) for row in data]
+    
+    return jsonify(months)
 
 @app.route('/api/financial-data', methods=['PUT'])
 @login_required
 def update_financial_data():
-    try:
-        data = request.get_json()
-        if not data:
-            return jsonify({
-                'status': 'error',
-                'message': 'Dados não fornecidos'
-            }), 400
-            
-        reference_date = data.get('reference_date')
-        if not reference_date:
-            return jsonify({
-                'status': 'error',
-                'message': 'Data de referência não fornecida'
-            }), 400
-            
-        # Buscar registro existente
-        financial_data = FinancialData.query.filter_by(
-            user_id=current_user.id,
-            reference_date=reference_date
-        ).first()
+    data = request.get_json()
+    if not data:
+        return jsonify({
+            'status': 'error',
+            'message': 'Dados não fornecidos'
+        }), 400
         
-        if not financial_data:
-            return jsonify({
-                'status': 'error',
-                'message': 'Dados não encontrados'
-            }), 404
-            
-        # Atualizar campos
-        try:
-            financial_data.cash_balance = float(data['cash_balance'])
-            financial_data.bank_balance = float(data['bank_balance'])
-            financial_data.accounts_receivable = float(data['accounts_receivable'])
-            financial_data.inventory_balance = float(data['inventory_balance'])
-            financial_data.other_credits = float(data['other_credits'])
-            financial_data.fixed_assets = float(data['fixed_assets'])
-            financial_data.investments = float(data['investments'])
-            financial_data.accounts_payable = float(data['accounts_payable'])
-            financial_data.loans_financing = float(data['loans_financing'])
-            financial_data.installments_payable = float(data['installments_payable'])
-            financial_data.total_sales = float(data['total_sales'])
-        except (ValueError, KeyError) as e:
-            return jsonify({
-                'status': 'error',
-                'message': f'Erro ao converter valores: {str(e)}'
-            }), 400
-            
-        db.session.commit()
+    reference_date = data.get('reference_date')
+    if not reference_date:
+        return jsonify({
+            'status': 'error',
+            'message': 'Data de referência não fornecida'
+        }), 400
+    
+    try:
+        reference_date = FinancialData.parse_mm_yyyy(reference_date)
+    except (ValueError, AttributeError):
+        return jsonify({
+            'status': 'error',
+            'message': 'Formato de data inválido. Use MM/YYYY'
+        }), 400
         
+    try:
+        money_vals = {key: Decimal(str(data[key])) for key in _MONEY_FIELDS}
+        if not all(amount.is_finite() for amount in money_vals.values()):
+            raise InvalidOperation('Valor não finito')
+        money_vals = {key: to_cents(amount) for key, amount in money_vals.items()}
+    except KeyError as e:
         return jsonify({
-            'status': 'success',
-            'message': 'Dados atualizados com sucesso'
-        })
+            'status': 'error',
+            'message': f'Erro ao converter valores: {str(e)}'
+        }), 400
+    except InvalidOperation:
+        return jsonify({
+            'status': 'error',
+            'message': 'Erro ao converter valores: valor monetário inválido'
+        }), 400
         
-    except Exception as e:
+    # Atualizar campos com um único UPDATE, sem carregar o registro no ORM
+    updated = db.session.execute(
+        update(FinancialData)
+        .where(FinancialData.user_id == current_user.id, FinancialData.reference_date == reference_date)
+        .values(**money_vals)
+    )
+    
+    if not updated.rowcount:
         db.session.rollback()
         return jsonify({
             'status': 'error',
-            'message': str(e)
-        }), 500
+            'message': 'Dados não encontrados'
+        }), 404
+        
+    db.session.commit()
+    
+    return jsonify({
+        'status': 'success',
+        'message': 'Dados atualizados com sucesso'
+    })
 
 @app.route('/api/financial-data/<reference_date>', methods=['DELETE'])
 @login_required
 def delete_financial_data(reference_date):
     """Exclui os dados financeiros de um mês específico"""
     try:
-        financial_data = FinancialData.query.filter_by(
-            user_id=current_user.id,
-            reference_date=reference_date
-        ).first()
-        
-        if not financial_data:
-            return jsonify({
-                'status': 'error',
-                'message': 'Dados não encontrados'
-            }), 404
-        
-        db.session.delete(financial_data)
-        db.session.commit()
-        return jsonify({
-            'status': 'success',
-            'message': 'Dados excluídos com sucesso!'
-        })
-    except Exception as e:
-        db.session.rollback()
+        reference_date = FinancialData.parse_mm_yyyy(reference_date)
+    except ValueError:
         return jsonify({
             'status': 'error',
-            'message': str(e)
+            'message': 'Formato de data inválido. Use MM/YYYY'
         }), 400
+    
+    financial_data = FinancialData.query.filter_by(
+        user_id=current_user.id,
+        reference_date=reference_date
+    ).first()
+    
+    if not financial_data:
+        return jsonify({
+            'status': 'error',
+            'message': 'Dados não encontrados'
+        }), 404
+    
+    db.session.delete(financial_data)
+    db.session.commit()
+    return jsonify({
+        'status': 'success',
+        'message': 'Dados excluídos com sucesso!'
+    })
 
 @app.route('/api/financial-results', methods=['GET'])
 @login_required
 def get_financial_results():
-    try:
-        # Buscar todos os dados financeiros ordenados por data
-        data = FinancialData.query.filter_by(user_id=current_user.id).order_by(FinancialData.reference_date).all()
-        
-        if not data:
-            return jsonify({
-                'status': 'success',
-                'data': []
-            })
-            
-        results = []
-        previous_equity = None
-        
-        for item in data:
-            # Calcular patrimônio líquido
-            equity = (
-                float(item.cash_balance) +
-                float(item.bank_balance) +
-                float(item.accounts_receivable) +
-                float(item.inventory_balance) +
-                float(item.other_credits) +
-                float(item.fixed_assets) +
-                float(item.investments) -
-                float(item.accounts_payable) -
-                float(item.loans_financing) -
-                float(item.installments_payable)
-            )
-            
-            # Calcular variação em relação ao mês anterior
-            if previous_equity is not None:
-                variation = ((equity - previous_equity) / previous_equity) * 100
-                variation_text = f"{variation:+.2f}%" if variation != 0 else "0,00%"
-            else:
-                variation_text = "N/A"
-                
-            # Calcular resultado sobre faturamento
-            revenue_result = (equity / float(item.total_sales)) * 100 if float(item.total_sales) > 0 else 0
-            
-            results.append({
-                'month': item.reference_date.strftime('%m/%Y'),
-                'equity': f"R$ {equity:,.2f}".replace(',', '_').replace('.', ',').replace('_', '.'),
-                'equity_raw': equity,  # Valor sem formatação para o gráfico
-                'variation': variation_text,
-                'revenue_result': f"{revenue_result:.2f}%"
-            })
-            
-            previous_equity = equity
-            
+    # Patrimônio líquido vem da coluna gerada; a variação mensal é calculada no banco
+    equity = FinancialData.equity
+    previous_equity = func.lag(equity).over(order_by=FinancialData.reference_date)
+    variation = (equity - previous_equity) * 100.0 / func.nullif(previous_equity, 0)
+    
+    data = db.session.query(
+        FinancialData.reference_date,
+        equity.label('equity'),
+        variation.label('variation'),
+        FinancialData.total_sales
+    ).filter_by(user_id=current_user.id).order_by(FinancialData.reference_date).all()
+    
+    if not data:
         return jsonify({
             'status': 'success',
-            'data': results
+            'data': []
         })
         
-    except Exception as e:
-        app.logger.error(f"Erro ao calcular resultados financeiros: {str(e)}")
-        return jsonify({
-            'status': 'error',
-            'message': 'Erro ao calcular resultados financeiros'
-        }), 500
+    results = []
+    
+    for item in data:
+        # Variação em relação ao mês anterior (NULL no primeiro mês ou com patrimônio anterior zero)
+        if item.variation is not None:
+            variation_text = f"{item.variation:+.2f}%" if item.variation != 0 else "0,00%"
+        else:
+            variation_text = "N/A"
+            
+        # Calcular resultado sobre faturamento
+        revenue_result = (item.equity / item.total_sales) * 100 if item.total_sales > 0 else 0
+        
+        results.append({
+            'month': FinancialData.format_mm_yyyy(item.reference_date),
+            'equity': format_currency(item.equity),
+            'equity_raw': item.equity / 100,  # Valor em reais sem formatação para o gráfico
+            'variation': variation_text,
+            'revenue_result': f"{revenue_result:.2f}%"
+        })
+        
+    return jsonify({
+        'status': 'success',
+        'data': results
+    })
 
 @app.route('/debug/all-data', methods=['GET'])
 @login_required
 def debug_all_data():
     """Rota temporária para debug - lista todos os dados no banco"""
-    try:
-        # Buscar todos os dados do usuário
-        user_data = FinancialData.query.filter_by(user_id=current_user.id).all()
-        print(f"\nDados encontrados para usuário {current_user.id}:")
+    if not app.debug:
+        abort(404)
         
-        result = []
-        for data in user_data:
-            item = {
-                'id': data.id,
-                'user_id': data.user_id,
-                'reference_date': data.reference_date,
-                'cash_balance': data.cash_balance,
-                'bank_balance': data.bank_balance,
-                'accounts_receivable': data.accounts_receivable,
-                'inventory_balance': data.inventory_balance,
-                'other_credits': data.other_credits,
-                'fixed_assets': data.fixed_assets,
-                'investments': data.investments,
-                'accounts_payable': data.accounts_payable,
-                'loans_financing': data.loans_financing,
-                'installments_payable': data.installments_payable,
-                'total_sales': data.total_sales
-            }
-            print(f"\nRegistro {data.id}:")
-            for key, value in item.items():
-                print(f"{key}: {value}")
-            result.append(item)
-            
-        return jsonify(result)
+    # Buscar todos os dados do usuário, sem instanciar objetos do ORM
+    rows = db.session.query(*FinancialData.__table__.columns).filter_by(user_id=current_user.id).all()
+    result = [dict(row._mapping) for row in rows]
         
-    except Exception as e:
-        print(f"Erro ao listar dados de debug: {str(e)}")
-        return jsonify({
-            'status': 'error',
-            'message': str(e)
-        }), 500
+    return jsonify(result)
 
 @app.route('/debug/db', methods=['GET'])
 @login_required
 def debug_db():
     """Rota temporária para debug - mostra todos os dados no banco"""
-    try:
-        # Buscar todos os dados
-        all_data = FinancialData.query.all()
-        print("\n=== DADOS NO BANCO ===")
-        print(f"Total de registros: {len(all_data)}")
+    if not app.debug:
+        abort(404)
         
-        result = []
-        for data in all_data:
-            item = {
-                'id': data.id,
-                'user_id': data.user_id,
-                'reference_date': data.reference_date,
-                'cash_balance': data.cash_balance,
-                'bank_balance': data.bank_balance,
-                'accounts_receivable': data.accounts_receivable,
-                'inventory_balance': data.inventory_balance,
-                'other_credits': data.other_credits,
-                'fixed_assets': data.fixed_assets,
-                'investments': data.investments,
-                'accounts_payable': data.accounts_payable,
-                'loans_financing': data.loans_financing,
-                'installments_payable': data.installments_payable,
-                'total_sales': data.total_sales
-            }
-            print(f"\nRegistro {data.id}:")
-            for key, value in item.items():
-                print(f"{key}: {value}")
-            result.append(item)
-            
-        return jsonify(result)
+    # Buscar todos os dados, sem instanciar objetos do ORM
+    rows = db.session.query(*FinancialData.__table__.columns).all()
+    result = [dict(row._mapping) for row in rows]
         
-    except Exception as e:
-        print(f"Erro ao debugar banco: {str(e)}")
-        return jsonify({
-            'status': 'error',
-            'message': str(e)
-        }), 500
+    return jsonify(result)
 
 @app.route('/debug/schema', methods=['GET'])
 @login_required
 def debug_schema():
     """Rota temporária para debug - mostra a estrutura da tabela"""
-    try:
-        # Pegar informações da tabela
-        table = FinancialData.__table__
-        print("\n=== ESTRUTURA DA TABELA ===")
-        print(f"Nome da tabela: {table.name}")
-        print("\nColunas:")
-        for column in table.columns:
-            print(f"{column.name}: {column.type}")
-            
-        return jsonify({
-            'table_name': table.name,
-            'columns': [{
-                'name': column.name,
-                'type': str(column.type)
-            } for column in table.columns]
-        })
-        
-    except Exception as e:
-        print(f"Erro ao mostrar schema: {str(e)}")
-        return jsonify({
-            'status': 'error',
-            'message': str(e)
-        }), 500
+    if not app.debug:
+        abort(404)
+        
+    # Pegar informações da tabela
+    table = FinancialData.__table__
+        
+    return jsonify({
+        'table_name': table.name,
+        'columns': [{
+            'name': column.name,
+            'type': str(column.type)
+        } for column in table.columns]
+    })
 
 @app.route('/logout')
 @login_required
@@ -625,16 +520,36 @@ def internal_error(error):
         }), 500
     return render_template('500.html'), 500
 
+@app.errorhandler(SQLAlchemyError)
+def handle_database_error(error):
+    # Desfaz a transação para que a sessão não fique inutilizada nas próximas requisições
+    db.session.rollback()
+    app.logger.exception("Erro no banco de dados: %s", error)
+    if request.path.startswith('/api/'):
+        return jsonify({
+            'status': 'error',
+            'message': 'Erro ao acessar o banco de dados'
+        }), 500
+    return render_template('500.html'), 500
+
 @app.errorhandler(Exception)
 def handle_exception(error):
+    # Erros HTTP (405, 401...) mantêm a resposta padrão do Werkzeug
+    if isinstance(error, HTTPException):
+        return error
+    # Desfaz qualquer transação pendente deixada pela exceção
+    db.session.rollback()
+    app.logger.exception("Erro não tratado: %s", error)
     if request.path.startswith('/api/'):
+        # O detalhe fica apenas no log; o cliente recebe uma mensagem genérica
         return jsonify({
             'status': 'error',
-            'message': str(error)
+            'message': 'Erro interno do servidor'
         }), 500
     return render_template('500.html'), 500
 
 if __name__ == '__main__':
     with app.app_context():
         db.create_all()
+    app.logger.setLevel(logging.DEBUG)
     app.run(debug=True)